@@ -33,81 +33,644 @@ USAGE:
 """
 
 import asyncio
+import hashlib
 import os
-from typing import Optional
-
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+import aiohttp
+import aiosqlite
+import orjson
 from azure.ai.projects.aio import AIProjectClient
 from azure.ai.agents.aio import AgentsClient
-from azure.ai.agents.models import DeepResearchTool, MessageRole, ThreadMessage
+from azure.ai.agents.models import (
+    AgentStreamEvent,
+    AgentThread,
+    DeepResearchTool,
+    MessageDeltaChunk,
+    MessageRole,
+    ThreadMessage,
+    ThreadRun,
+)
+from azure.core.exceptions import IncompleteReadError, ServiceResponseError
 from azure.identity.aio import DefaultAzureCredential
 from fastmcp import FastMCP, Context
 from typing import Annotated, Literal
 from pydantic import Field
 import logging
-from rich.logging import RichHandler
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# RichHandler renders every record with markup and is noticeably slower than a plain
+# StreamHandler, so it is only used when DR_RICH_LOGS=1 (e.g. for local development).
+if os.getenv("DR_RICH_LOGS") == "1":
+    from rich.logging import RichHandler
+
+    log_handler = RichHandler()
+else:
+    log_handler = logging.StreamHandler()
 
 logging.basicConfig(
     format="[%(asctime)s - %(name)s:%(lineno)d - %(levelname)s] %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
     level=logging.INFO,
-    handlers=[RichHandler()]
+    handlers=[log_handler]
 )
 
 # Add the handler to the logger
 
 logger = logging.getLogger(__name__)
 
-from dotenv import load_dotenv
-
-load_dotenv()
+# Required settings, see the module docstring. They are checked by `_validate_env()` at startup.
+PROJECT_ENDPOINT = os.getenv("PROJECT_ENDPOINT", "")
+BING_RESOURCE_NAME = os.getenv("BING_RESOURCE_NAME", "")
+MODEL_DEPLOYMENT_NAME = os.getenv("MODEL_DEPLOYMENT_NAME", "")
+DEEP_RESEARCH_MODEL_DEPLOYMENT_NAME = os.getenv("DEEP_RESEARCH_MODEL_DEPLOYMENT_NAME", "")
+
+# How run completion is observed: "stream" (server-sent run events), "adaptive"
+# (exponential backoff polling with jitter) or "fixed" (poll every 10 seconds).
+POLL_STRATEGY = os.getenv("DR_POLL_STRATEGY", "stream").lower()
+if POLL_STRATEGY not in ("stream", "adaptive", "fixed"):
+    logger.warning("Unknown DR_POLL_STRATEGY '%s', falling back to 'adaptive'.", POLL_STRATEGY)
+    POLL_STRATEGY = "adaptive"
+
+FIXED_POLL_INTERVAL_S = 10.0
+ADAPTIVE_POLL_INITIAL_S = 1.0
+ADAPTIVE_POLL_MAX_S = 15.0
+ADAPTIVE_POLL_JITTER_S = 0.25
+
+# Finished reports are kept in memory so repeated requests skip the multi-minute run.
+CACHE_TTL_S = float(os.getenv("DR_CACHE_TTL_S", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("DR_CACHE_MAX_ENTRIES", "256"))
+
+# Runs are recorded in SQLite so they can be resumed after a worker restart.
+RUN_DB_PATH = os.getenv("DR_RUN_DB_PATH", "deep_research_runs.db")
+ACTIVE_RUN_STATUSES = ("queued", "in_progress")
+
+# At most DR_MAX_CONCURRENCY runs are followed at once; further requests wait for a slot.
+# Runs still active after DR_RUN_TIMEOUT_S are cancelled so they release their slot.
+MAX_CONCURRENT_RUNS = int(os.getenv("DR_MAX_CONCURRENCY", "4"))
+RUN_TIMEOUT_S = float(os.getenv("DR_RUN_TIMEOUT_S", "3600"))
+
+REPORT_INSTRUCTIONS_TEMPLATE = (
+    "Provide a {report_type} report on the topic: '{research_topic}'.\n"
+    "Use the language {language} for the report.\n"
+    "Do not ask the user for any additional information, just provide the report.\n"
+)
 
 mcp = FastMCP("Deep Research Server")
 
+class ReportCache:
+    """In-process LRU cache of finished reports, keyed by `request_key`, with a time-to-live."""
+
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, report = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return report
+
+    def set(self, key: str, report: str) -> None:
+        if self.max_entries <= 0 or self.ttl_s <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_s, report)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RunRegistry:
+    """Durable record of Deep Research runs, keyed by `request_key`, stored in SQLite.
+
+    A row is written as soon as a run is created and updated with the final status and
+    report when it finishes, so runs that were in progress when the worker stopped can
+    be resumed and finished reports can be delivered again. Finished rows are only
+    delivered again within `ttl_s` of the run's creation, older ones are deleted when
+    the database is opened and whenever a run finishes.
+    """
+
+    def __init__(self, path: str, ttl_s: float = CACHE_TTL_S):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._db: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        if self._db is None:
+            async with self._lock:
+                if self._db is None:
+                    db = await aiosqlite.connect(self.path)
+                    db.row_factory = aiosqlite.Row
+                    await db.execute(
+                        "CREATE TABLE IF NOT EXISTS runs ("
+                        "key TEXT PRIMARY KEY, thread_id TEXT, run_id TEXT, agent_id TEXT, "
+                        "created_at REAL, status TEXT, report TEXT, request TEXT)"
+                    )
+                    # Databases created before the request column existed get it added.
+                    async with db.execute("PRAGMA table_info(runs)") as cursor:
+                        columns = {row["name"] for row in await cursor.fetchall()}
+                    if "request" not in columns:
+                        await db.execute("ALTER TABLE runs ADD COLUMN request TEXT")
+                    await self._prune(db)
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def get(self, key: str) -> Optional[aiosqlite.Row]:
+        db = await self._connect()
+        async with db.execute("SELECT * FROM runs WHERE key = ?", (key,)) as cursor:
+            return await cursor.fetchone()
+
+    async def active(self) -> list[aiosqlite.Row]:
+        db = await self._connect()
+        placeholders = ", ".join("?" for _ in ACTIVE_RUN_STATUSES)
+        async with db.execute(f"SELECT * FROM runs WHERE status IN ({placeholders})", ACTIVE_RUN_STATUSES) as cursor:
+            return list(await cursor.fetchall())
+
+    async def add(
+        self,
+        key: str,
+        thread_id: str,
+        run_id: str,
+        agent_id: str,
+        status: str,
+        request: Optional[dict] = None,
+    ) -> None:
+        db = await self._connect()
+        await db.execute(
+            "INSERT OR REPLACE INTO runs (key, thread_id, run_id, agent_id, created_at, status, report, request) "
+            "VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+            (key, thread_id, run_id, agent_id, time.time(), status, _dumps(request) if request is not None else None),
+        )
+        await db.commit()
+
+    async def finish(self, key: str, status: str, report: Optional[str] = None) -> None:
+        db = await self._connect()
+        await db.execute("UPDATE runs SET status = ?, report = ? WHERE key = ?", (status, report, key))
+        await self._prune(db)
+        await db.commit()
+
+    async def _prune(self, db: aiosqlite.Connection) -> None:
+        placeholders = ", ".join("?" for _ in ACTIVE_RUN_STATUSES)
+        await db.execute(
+            f"DELETE FROM runs WHERE status NOT IN ({placeholders}) AND created_at < ?",
+            (*ACTIVE_RUN_STATUSES, time.time() - self.ttl_s),
+        )
+
+
+def _dumps(obj) -> str:
+    """Serialize `obj` to a JSON string. orjson is used for all JSON the server writes."""
+    return orjson.dumps(obj).decode()
+
+
+def _status_value(status) -> str:
+    """Return the plain string value of a run status, which may be a RunStatus enum."""
+    return getattr(status, "value", status)
+
+
+report_cache = ReportCache(max_entries=CACHE_MAX_ENTRIES, ttl_s=CACHE_TTL_S)
+run_registry = RunRegistry(RUN_DB_PATH)
+# Reports of runs currently in progress, keyed by `request_key`.
+_inflight: dict[str, asyncio.Task] = {}
+_run_slots = asyncio.Semaphore(MAX_CONCURRENT_RUNS)
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-flight.
+_background_tasks: set[asyncio.Task] = set()
+
+# A single credential and project client are shared by all tool invocations so that AAD
+# tokens, TLS sessions and pooled connections are reused. They are closed in `main()`.
+_credential = DefaultAzureCredential()
+_project_client: Optional[AIProjectClient] = None
+_project_client_lock = asyncio.Lock()
+# The Deep Research tool only depends on settings, so the Bing connection is looked up once.
+_deep_research_tool: Optional[DeepResearchTool] = None
+_deep_research_tool_lock = asyncio.Lock()
+
+
+async def get_project_client() -> AIProjectClient:
+    global _project_client
+    if _project_client is None:
+        async with _project_client_lock:
+            if _project_client is None:
+                _project_client = AIProjectClient(
+                    endpoint=PROJECT_ENDPOINT,
+                    credential=_credential,
+                )
+    return _project_client
+
+
+async def close_project_client() -> None:
+    global _project_client
+    if _project_client is not None:
+        await _project_client.close()
+        _project_client = None
+    await _credential.close()
+
+
+async def get_deep_research_tool(project_client: AIProjectClient) -> DeepResearchTool:
+    global _deep_research_tool
+    if _deep_research_tool is None:
+        async with _deep_research_tool_lock:
+            if _deep_research_tool is None:
+                bing_connection = await project_client.connections.get(name=BING_RESOURCE_NAME)
+                # Initialize a Deep Research tool with Bing Connection ID and Deep Research model deployment name
+                _deep_research_tool = DeepResearchTool(
+                    bing_grounding_connection_id=bing_connection.id,
+                    deep_research_model=DEEP_RESEARCH_MODEL_DEPLOYMENT_NAME,
+                )
+    return _deep_research_tool
+
+
+class ResearchRequest(NamedTuple):
+    """The arguments of a `retrieve_deep_research_report` call.
+
+    Their types, defaults and validation are defined by the tool's signature only.
+    """
+
+    research_topic: str
+    report_type: str
+    language: str
+    other_instructions: Optional[str]
+
+
+def request_key(req: ResearchRequest) -> str:
+    """Return a stable key for a research request.
+
+    Fields are case-folded and whitespace-collapsed so trivially different spellings of
+    the same request share one key.
+    """
+    fields = (req.report_type, req.language, req.research_topic, req.other_instructions or "")
+    canonical = "|".join(" ".join(f.casefold().split()) for f in fields)
+    return hashlib.md5(canonical.encode()).hexdigest()
+
+
+class _CtxBatcher:
+    """Collect messages for the MCP client and send them as one `ctx.info` per flush.
+
+    At most `max_entries` messages are buffered between flushes; when more are added,
+    the oldest ones are dropped.
+    """
+
+    def __init__(self, ctx: Context, max_entries: int = 32):
+        self._ctx = ctx
+        self._buf: deque[str] = deque(maxlen=max_entries)
+
+    def add(self, msg: str) -> None:
+        self._buf.append(msg)
+
+    async def flush(self) -> None:
+        if not self._buf:
+            return
+        msg = "\n".join(self._buf)
+        self._buf.clear()
+        await self._ctx.info(msg)
+
+
 async def fetch_and_print_new_agent_response(
     thread_id: str,
     agents_client: AgentsClient,
     last_message_id: Optional[str] = None,
-    ctx: Context = None,
-) -> Optional[str]:
+    batcher: Optional[_CtxBatcher] = None,
+    seen_citations: Optional[set[str]] = None,
+) -> tuple[Optional[str], Optional[ThreadMessage]]:
+    """Fetch the latest agent message and print it if it is new.
+
+    Returns the id of the last printed message and the fetched message, so callers can
+    reuse it instead of fetching it again.
+    """
     response = await agents_client.messages.get_last_message_by_role(
         thread_id=thread_id,
         role=MessageRole.AGENT,
     )
 
     if not response or response.id == last_message_id:
-        return last_message_id
-
-    logger.info("\nAgent response:")
-    logger.info("\n".join(t.text.value for t in response.text_messages))
-    if ctx:
-        await ctx.info("\nAgent response:"+"\n".join(t.text.value for t in response.text_messages))
+        return last_message_id, response
+
+    print_agent_response(response, batcher, seen_citations)
+    return response.id, response
+
+
+def print_agent_response(
+    response: ThreadMessage,
+    batcher: Optional[_CtxBatcher] = None,
+    seen_citations: Optional[set[str]] = None,
+) -> list[str]:
+    """Log an agent message and its citations, and queue them on `batcher` for the client.
+
+    Citation URLs already in `seen_citations` are skipped, and new ones are added to it,
+    so each citation is reported once per run rather than once per message. Returns the
+    citations that were reported.
+    """
+    # The joined text can be hundreds of KB, only build it when someone will see it.
+    if batcher is not None or logger.isEnabledFor(logging.INFO):
+        response_text = "\n".join(t.text.value for t in response.text_messages)
+        logger.info("\nAgent response:\n%s", response_text)
+        if batcher:
+            batcher.add("\nAgent response:" + response_text)
     # Print citation annotations (if any)
+    citations = []
     for ann in response.url_citation_annotations:
-        logger.info(f"URL Citation: [{ann.url_citation.title}]({ann.url_citation.url})")
-        if ctx:
-            await ctx.info(f"URL Citation: [{ann.url_citation.title}]({ann.url_citation.url})")
-    return response.id
+        if seen_citations is not None:
+            if ann.url_citation.url in seen_citations:
+                continue
+            seen_citations.add(ann.url_citation.url)
+        citations.append(f"URL Citation: [{ann.url_citation.title}]({ann.url_citation.url})")
+    for citation in citations:
+        logger.info(citation)
+    if batcher and citations:
+        batcher.add("\n".join(citations))
+    return citations
+
+
+async def _await_run(
+    agents_client: AgentsClient,
+    thread_id: str,
+    run: ThreadRun,
+    ctx: Context = None,
+) -> tuple[ThreadRun, Optional[ThreadMessage]]:
+    """Poll a run until it leaves the queued/in_progress states.
+
+    Returns the final run and the last agent message fetched while polling. The message
+    is fetched after the run status on every iteration, so once the run has finished it
+    is the final message.
+
+    With the "adaptive" strategy the delay starts at one second and doubles (plus jitter)
+    up to ADAPTIVE_POLL_MAX_S, so short runs are noticed quickly without hammering
+    `runs.get` on long ones. The "fixed" strategy keeps the original 10 second interval.
+    """
+    delay = ADAPTIVE_POLL_INITIAL_S
+    last_message_id: Optional[str] = None
+    last_message: Optional[ThreadMessage] = None
+    # Everything reported to the client during one poll goes out as a single message.
+    batcher = _CtxBatcher(ctx) if ctx else None
+    seen_citations: set[str] = set()
+    while run.status in ACTIVE_RUN_STATUSES:
+        if POLL_STRATEGY == "fixed":
+            await asyncio.sleep(FIXED_POLL_INTERVAL_S)
+        else:
+            await asyncio.sleep(delay + random.uniform(0, ADAPTIVE_POLL_JITTER_S))
+            delay = min(delay * 2, ADAPTIVE_POLL_MAX_S)
+        run = await agents_client.runs.get(thread_id=thread_id, run_id=run.id)
+
+        last_message_id, last_message = await fetch_and_print_new_agent_response(
+            thread_id=thread_id,
+            agents_client=agents_client,
+            last_message_id=last_message_id,
+            batcher=batcher,
+            seen_citations=seen_citations,
+        )
+        logger.info("Run status: %s", run.status)
+        if batcher:
+            batcher.add(f"Run status: {run.status}")
+            await batcher.flush()
+    return run, last_message
+
+
+class _DeltaForwarder:
+    """Forward streamed message text to the MCP client from a background task.
+
+    Deltas go through a bounded queue. Once text arrives, the drain task keeps collecting
+    for up to `flush_interval_s` or until `flush_chars` characters have accumulated, then
+    sends everything as a single `ctx.info`. If the client falls behind and the queue fills
+    up, the oldest pending delta is dropped; the full text is still part of the final report.
+    Status lines and citations go through `push_line`, so the client gets them in order
+    with the text around them.
+    """
+
+    def __init__(
+        self,
+        ctx: Context = None,
+        maxsize: int = 64,
+        flush_interval_s: float = 0.25,
+        flush_chars: int = 2000,
+    ):
+        self._ctx = ctx
+        self._queue: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=maxsize)
+        self._more = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.flush_interval_s = flush_interval_s
+        self.flush_chars = flush_chars
+
+    async def __aenter__(self) -> "_DeltaForwarder":
+        if self._ctx:
+            self._task = asyncio.create_task(self._drain())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._task is None:
+            return
+        # The sentinel tells the drain task to flush what is pending and stop.
+        self._put(None)
+        try:
+            await self._task
+        except Exception as e:
+            logger.warning("Failed to forward streamed agent response: %s", e)
+
+    def push(self, text: Optional[str]) -> None:
+        if self._task is not None and text:
+            self._put(text)
+
+    def push_line(self, line: str) -> None:
+        self.push(f"\n{line}\n")
+
+    def _put(self, item: Optional[str]) -> None:
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(item)
+        self._more.set()
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            parts = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval_s
+            while True:
+                # Move everything pending out of the queue so it does not fill up while waiting.
+                while not self._queue.empty():
+                    parts.append(self._queue.get_nowait())
+                if None in parts:
+                    done = True
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0 or sum(len(p) for p in parts) >= self.flush_chars:
+                    break
+                self._more.clear()
+                try:
+                    await asyncio.wait_for(self._more.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+            text = "".join(p for p in parts if p is not None)
+            if text:
+                await self._ctx.info(text)
+
+
+async def _stream_run(
+    agents_client: AgentsClient,
+    thread_id: str,
+    agent_id: str,
+    ctx: Context = None,
+    on_run_created: Optional[Callable[[ThreadRun], Awaitable[None]]] = None,
+) -> tuple[ThreadRun, Optional[ThreadMessage]]:
+    """Create a run and follow its server-sent events until it terminates.
+
+    `on_run_created` is awaited with the first run event, once the run id is known.
+
+    Completion is observed as soon as the service emits it instead of on the next poll,
+    and message text is forwarded to the MCP client as it is generated. Returns the final
+    run together with the last completed agent message, so the caller does not need to
+    fetch it again. If the event stream ends or its connection drops while the run is
+    still active, fall back to adaptive polling for the remainder of the run.
+    """
+    run: Optional[ThreadRun] = None
+    last_message: Optional[ThreadMessage] = None
+    seen_citations: set[str] = set()
+    async with _DeltaForwarder(ctx) as forwarder:
+        try:
+            async with await agents_client.runs.stream(thread_id=thread_id, agent_id=agent_id) as stream:
+                async for event_type, event_data, _ in stream:
+                    if isinstance(event_data, MessageDeltaChunk):
+                        forwarder.push(event_data.text)
+                    elif isinstance(event_data, ThreadRun):
+                        if run is None and on_run_created is not None:
+                            await on_run_created(event_data)
+                        if run is None or event_data.status != run.status:
+                            logger.info("Run status: %s", event_data.status)
+                            forwarder.push_line(f"Run status: {event_data.status}")
+                        run = event_data
+                    elif (
+                        event_type == AgentStreamEvent.THREAD_MESSAGE_COMPLETED
+                        and isinstance(event_data, ThreadMessage)
+                        and event_data.role == MessageRole.AGENT
+                    ):
+                        # The text already reached the client as deltas, only its new
+                        # citations are forwarded.
+                        for citation in print_agent_response(event_data, seen_citations=seen_citations):
+                            forwarder.push_line(citation)
+                        last_message = event_data
+                    elif event_type == AgentStreamEvent.ERROR:
+                        logger.error("Run stream error: %s", event_data)
+                    elif event_type == AgentStreamEvent.DONE:
+                        break
+        except (ServiceResponseError, IncompleteReadError, aiohttp.ClientError) as e:
+            # Without a run id there is nothing to poll, so the error is surfaced as is.
+            if run is None:
+                raise
+            logger.warning("Run event stream failed: %r", e)
+
+    if run is None:
+        raise RuntimeError("Run event stream ended before the run was created.")
+    if run.status in ACTIVE_RUN_STATUSES:
+        logger.info("Run event stream ended early, falling back to polling.")
+        run, last_message = await _await_run(agents_client, thread_id, run, ctx)
+    return run, last_message
 
 
 def create_research_summary(message: ThreadMessage) -> str:
     if not message:
         logger.info("No message content provided, cannot create research summary.")
         return
-    report_content = "\n\n".join([t.text.value.strip() for t in message.text_messages])
-        # Write unique URL citations, if present
+    parts = [t.text.value.strip() for t in message.text_messages]
+    # Write unique URL citations, if present, keeping the first title seen for each URL
     if message.url_citation_annotations:
-        report_content += "\n\n## References\n"
-        seen_urls = set()
+        references: dict[str, str] = {}
         for ann in message.url_citation_annotations:
             url = ann.url_citation.url
-            title = ann.url_citation.title or url
-            if url not in seen_urls:
-                report_content += f"- [{title}]({url})\n"
-                seen_urls.add(url)
+            references.setdefault(url, ann.url_citation.title or url)
+        parts.append("## References\n" + "\n".join(f"- [{title}]({url})" for url, title in references.items()))
+    report_content = "\n\n".join(parts)
 
-    logger.info(f"Research report content:\n{report_content}")
+    logger.debug("Research report content:\n%s", report_content)
     return report_content
 
+def _spawn(coro: Awaitable) -> asyncio.Task:
+    """Run a coroutine in the background, keeping a reference until it is done."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
+def _background_task_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed: %r", task.exception())
+
+
+class _BestEffortContext:
+    """Wrap a Context so that messages to a client that has gone away are dropped.
+
+    A shared run keeps going after the client that started it disconnects, and its
+    progress messages must not fail the run for everyone else waiting on it.
+    """
+
+    def __init__(self, ctx: Context):
+        self._ctx = ctx
+
+    async def info(self, msg: str) -> None:
+        try:
+            await self._ctx.info(msg)
+        except Exception as e:
+            logger.debug("Dropping message for disconnected client: %r", e)
+
+    async def error(self, msg: str) -> None:
+        try:
+            await self._ctx.error(msg)
+        except Exception as e:
+            logger.debug("Dropping message for disconnected client: %r", e)
+
+
+def _start_once(key: str, start: Callable[[], Awaitable[str]]) -> asyncio.Task:
+    """Return the in-flight task for `key`, starting one with `start` if there is none.
+
+    The task runs in the background rather than in the caller's task, so cancelling a
+    caller (e.g. its client disconnects) does not abort the run for the others.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = _spawn(start())
+        _inflight[key] = task
+
+        def forget(done: asyncio.Task) -> None:
+            if _inflight.get(key) is done:
+                del _inflight[key]
+
+        task.add_done_callback(forget)
+    return task
+
+
+async def _run_once(key: str, start: Callable[[], Awaitable[str]], ctx: Context = None) -> str:
+    """Run `start` for a request unless an identical request is already in flight.
+
+    Identical requests that arrive while a run is in flight wait for that run's report
+    instead of starting another one. Checking and registering happen without an await
+    in between, so no lock is needed on the event loop.
+    """
+    if key in _inflight:
+        logger.info("Joining in-flight run for request %s", key)
+        if ctx:
+            await ctx.info("An identical research request is already running, waiting for its report...")
+    return await asyncio.shield(_start_once(key, start))
+
+
 @mcp.tool(
         name="retrieve_deep_research_report",
         description="Retrieve a Deep Research report on a specific topic based on user input.",
@@ -120,57 +683,102 @@ async def retrieve_deep_research_report(
     other_instructions: Optional[Annotated[str, Field(description="Additional instructions for the agent, if any")]] = None,
 ) -> str:
 
-    project_client = AIProjectClient(
-        endpoint=os.environ["PROJECT_ENDPOINT"],
-        credential=DefaultAzureCredential(),
-    )
-
-    bing_connection = await project_client.connections.get(name=os.environ["BING_RESOURCE_NAME"])
-
-    # Initialize a Deep Research tool with Bing Connection ID and Deep Research model deployment name
-    deep_research_tool = DeepResearchTool(
-        bing_grounding_connection_id=bing_connection.id,
-        deep_research_model=os.environ["DEEP_RESEARCH_MODEL_DEPLOYMENT_NAME"],
+    req = ResearchRequest(
+        research_topic=research_topic,
+        report_type=report_type,
+        language=language,
+        other_instructions=other_instructions,
     )
+    key = request_key(req)
+    cached_report = report_cache.get(key)
+    if cached_report is not None:
+        logger.info("Cache hit for request %s", key)
+        await ctx.info("Returning cached report.")
+        return cached_report
+
+    shared_ctx = _BestEffortContext(ctx)
+    return await _run_once(key, lambda: _run_deep_research(key, req, shared_ctx), ctx)
+
+
+async def _run_deep_research(key: str, req: ResearchRequest, ctx: Context) -> str:
+    # A run for the same request may already be recorded: deliver its report again if it
+    # finished recently, or attach to it if it is still running (e.g. after a restart).
+    # The registry only adds durability, so requests are still served without it.
+    try:
+        record = await run_registry.get(key)
+    except Exception as e:
+        logger.warning("Failed to look up run record for request %s: %r", key, e)
+        record = None
+    if record is not None:
+        if record["status"] == "completed" and record["report"] and time.time() - record["created_at"] < CACHE_TTL_S:
+            logger.info("Delivering recorded report for request %s", key)
+            await ctx.info("Returning previously generated report.")
+            report_cache.set(key, record["report"])
+            return record["report"]
+        if record["status"] in ACTIVE_RUN_STATUSES:
+            logger.info("Attaching to recorded run %s for request %s", record['run_id'], key)
+            await ctx.info("Attaching to a research run that is already in progress...")
+            try:
+                return await _resume_run(record, ctx)
+            except Exception:
+                # The recorded run has been marked failed, start over with a new one.
+                await ctx.info("The recorded research run could not be resumed, starting a new one...")
+
+    async with _run_slot(ctx):
+        return await _start_run(key, req, ctx)
+
+
+@asynccontextmanager
+async def _run_slot(ctx: Context = None):
+    """Hold one of the MAX_CONCURRENT_RUNS run slots, telling the client if it has to wait."""
+    if _run_slots.locked():
+        logger.info("All run slots are busy, waiting for one to free up.")
+        if ctx:
+            await ctx.info(f"Queued: all {MAX_CONCURRENT_RUNS} research slots are busy, waiting for one to free up...")
+    async with _run_slots:
+        yield
 
-    async with project_client:
 
-        agents_client = project_client.agents
+async def _start_run(key: str, req: ResearchRequest, ctx: Context) -> str:
+    project_client = await get_project_client()
+    deep_research_tool = await get_deep_research_tool(project_client)
 
-        # Create a new agent that has the Deep Research tool attached.
-        # NOTE: To add Deep Research to an existing agent, fetch it with `get_agent(agent_id)` and then,
-        # update the agent with the Deep Research tool.
-        agent = await agents_client.create_agent(
-            model=os.environ["MODEL_DEPLOYMENT_NAME"],
-            name="my-agent",
-            instructions="You are a helpful Agent that assists in researching topics that user provides.",
-            tools=deep_research_tool.definitions,
-        )
-        await ctx.info("Agent created.")
-        logger.info(f"Created agent, ID: {agent.id}")
+    agents_client = project_client.agents
 
+    # Create a new agent that has the Deep Research tool attached.
+    # NOTE: To add Deep Research to an existing agent, fetch it with `get_agent(agent_id)` and then,
+    # update the agent with the Deep Research tool.
+    agent = await agents_client.create_agent(
+        model=MODEL_DEPLOYMENT_NAME,
+        name="my-agent",
+        instructions="You are a helpful Agent that assists in researching topics that user provides.",
+        tools=deep_research_tool.definitions,
+    )
+    await ctx.info("Agent created.")
+    logger.info("Created agent, ID: %s", agent.id)
+
+    # The agent and thread are deleted in the background once the run is over, including
+    # when creating or following the run fails, in which case a recorded run is cancelled and
+    # marked failed first. They are kept when the task is cancelled while a recorded run is
+    # still active (e.g. the worker is shutting down) so that it can be resumed later.
+    thread: Optional[AgentThread] = None
+    run: Optional[ThreadRun] = None
+    run_finished = False
+    keep_resources = False
+    try:
         # Create thread for communication
         thread = await agents_client.threads.create()
         await ctx.info("Thread created.")
-        logger.info(f"Created thread, ID: {thread.id}")
+        logger.info("Created thread, ID: %s", thread.id)
 
         # Format Instructions
-
-        report_instructions_template = """
-        Provide a {report_type} report on the topic: '{research_topic}'.
-        Use the language {language} for the report.
-        Do not ask the user for any additional information, just provide the report.
-        """
-
-        report_instructions = report_instructions_template.format(
-            report_type=report_type,
-            research_topic=research_topic,
-            language=language,
-        ) if not other_instructions else report_instructions_template.format(
-            report_type=report_type,
-            research_topic=research_topic,
-            language=language,
-        )+ f"# Other Instructions\n\n{other_instructions}\n\n"
+        report_instructions = REPORT_INSTRUCTIONS_TEMPLATE.format(
+            report_type=req.report_type,
+            research_topic=req.research_topic,
+            language=req.language,
+        )
+        if req.other_instructions:
+            report_instructions += f"\n# Other Instructions\n\n{req.other_instructions}\n\n"
         # Create message to thread
         message = await agents_client.messages.create(
             thread_id=thread.id,
@@ -179,49 +787,233 @@ async def retrieve_deep_research_report(
                 report_instructions
             ),
         )
-        logger.info(f"Created message, ID: {message.id}")
+        logger.info("Created message, ID: %s", message.id)
+
+        async def record_run(created: ThreadRun) -> None:
+            nonlocal run
+            try:
+                await run_registry.add(
+                    key, thread.id, created.id, agent.id, _status_value(created.status), request=req._asdict()
+                )
+            except Exception as e:
+                logger.warning("Failed to record run %s, it will not be resumed after a restart: %r", created.id, e)
+            run = created
 
         await ctx.info("Starting the research process... this may take a few minutes. Be patient!")
         logger.info("Start processing the message... this may take a few minutes to finish. Be patient!")
-        # Poll the run as long as run status is queued or in progress
-        run = await agents_client.runs.create(thread_id=thread.id, agent_id=agent.id)
-        last_message_id: Optional[str] = None
-        while run.status in ("queued", "in_progress"):
-            await asyncio.sleep(10)
-            run = await agents_client.runs.get(thread_id=thread.id, run_id=run.id)
-
-            last_message_id = await fetch_and_print_new_agent_response(
-                thread_id=thread.id,
-                agents_client=agents_client,
-                last_message_id=last_message_id,
-                ctx=ctx,
-            )
-            logger.info(f"Run status: {run.status}")
-            await ctx.info(f"Run status: {run.status}")
-
-        logger.info(f"Run finished with status: {run.status}, ID: {run.id}")
+        # Follow the run until it is no longer queued or in progress. Streaming is preferred
+        # when the SDK supports it, otherwise the run is polled.
+        final_message: Optional[ThreadMessage] = None
+        try:
+            if POLL_STRATEGY == "stream" and hasattr(agents_client.runs, "stream"):
+                run, final_message = await asyncio.wait_for(
+                    _stream_run(agents_client, thread.id, agent.id, ctx, on_run_created=record_run),
+                    timeout=RUN_TIMEOUT_S,
+                )
+            else:
+                await record_run(await agents_client.runs.create(thread_id=thread.id, agent_id=agent.id))
+                run, final_message = await asyncio.wait_for(
+                    _await_run(agents_client, thread.id, run, ctx),
+                    timeout=RUN_TIMEOUT_S,
+                )
+        except asyncio.TimeoutError:
+            if run is None:
+                raise
+            run = await _cancel_run(agents_client, thread.id, run.id, ctx)
+        run_finished = True
+
+        return await _finish_run(key, agents_client, thread.id, run, final_message, ctx)
+    except asyncio.CancelledError:
+        keep_resources = run is not None and not run_finished
+        raise
+    except Exception as e:
+        if run is not None:
+            logger.warning("Run %s for request %s failed: %r", run.id, key, e)
+            keep_resources = True
+            await _abandon_run(agents_client, key, thread.id, run.id, agent.id)
+        raise
+    finally:
+        if not keep_resources:
+            _spawn(_safe_delete(agents_client, agent.id, thread.id if thread else None))
+
+
+async def _resume_run(record: aiosqlite.Row, ctx: Context = None) -> str:
+    """Poll a recorded run until it finishes and produce its report.
+
+    The run timeout counts from when the run was recorded, not from when it was resumed.
+    """
+    async with _run_slot(ctx):
+        project_client = await get_project_client()
+        agents_client = project_client.agents
+        run_finished = False
+        abandoned = False
+        try:
+            run = await agents_client.runs.get(thread_id=record["thread_id"], run_id=record["run_id"])
+            final_message: Optional[ThreadMessage] = None
+            if _status_value(run.status) in ACTIVE_RUN_STATUSES:
+                try:
+                    run, final_message = await asyncio.wait_for(
+                        _await_run(agents_client, record["thread_id"], run, ctx),
+                        timeout=max(RUN_TIMEOUT_S - (time.time() - record["created_at"]), 0),
+                    )
+                except asyncio.TimeoutError:
+                    run = await _cancel_run(agents_client, record["thread_id"], run.id, ctx)
+            run_finished = True
+            return await _finish_run(record["key"], agents_client, record["thread_id"], run, final_message, ctx)
+        except Exception as e:
+            # Otherwise the record would stay active and every later identical request, and
+            # every restart, would try to resume it again.
+            logger.warning("Failed to resume run %s for request %s: %r", record["run_id"], record["key"], e)
+            abandoned = True
+            await _abandon_run(agents_client, record["key"], record["thread_id"], record["run_id"], record["agent_id"])
+            raise
+        finally:
+            if run_finished and not abandoned:
+                _spawn(_safe_delete(agents_client, record["agent_id"], record["thread_id"]))
+
+
+async def _abandon_run(agents_client: AgentsClient, key: str, thread_id: str, run_id: str, agent_id: str) -> None:
+    """Give up on a run that can no longer be followed.
+
+    The record is marked failed right away so the request can be retried; cancelling the
+    run and deleting its agent and thread happen in the background.
+    """
+    try:
+        await run_registry.finish(key, "failed")
+    except Exception as e:
+        logger.warning("Failed to mark run %s as failed: %r", run_id, e)
+    _spawn(_cancel_and_delete(agents_client, thread_id, run_id, agent_id))
+
+
+async def _cancel_and_delete(agents_client: AgentsClient, thread_id: str, run_id: str, agent_id: str) -> None:
+    try:
+        await agents_client.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.debug("Could not cancel run %s: %r", run_id, e)
+    await _safe_delete(agents_client, agent_id, thread_id)
+
+
+async def _cancel_run(agents_client: AgentsClient, thread_id: str, run_id: str, ctx: Context = None) -> ThreadRun:
+    """Cancel a run that exceeded RUN_TIMEOUT_S."""
+    logger.warning("Run %s did not finish within %.0fs, cancelling it.", run_id, RUN_TIMEOUT_S)
+    if ctx:
+        await ctx.error(f"Run did not finish within {RUN_TIMEOUT_S:.0f} seconds and was cancelled.")
+    try:
+        return await agents_client.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception:
+        # The run may have finished between the timeout and the cancel request.
+        run = await agents_client.runs.get(thread_id=thread_id, run_id=run_id)
+        if _status_value(run.status) in ACTIVE_RUN_STATUSES:
+            raise
+        return run
+
+
+async def _finish_run(
+    key: str,
+    agents_client: AgentsClient,
+    thread_id: str,
+    run: ThreadRun,
+    final_message: Optional[ThreadMessage],
+    ctx: Context = None,
+) -> str:
+    logger.info("Run finished with status: %s, ID: %s", run.status, run.id)
+    if ctx:
         await ctx.info(f"Run finished with status: {run.status}")
 
-        if run.status == "failed":
-            logger.info(f"Run failed: {run.last_error}")
+    if run.status == "failed":
+        logger.info("Run failed: %s", run.last_error)
+        if ctx:
             await ctx.error(f"Run failed: {run.last_error}")
 
-        # Fetch the final message from the agent in the thread and create a research summary
+    # Create a research summary from the final agent message. It is only fetched here if
+    # the run finished before it could be observed.
+    report_content: Optional[str] = None
+    if final_message is None:
         final_message = await agents_client.messages.get_last_message_by_role(
-            thread_id=thread.id, role=MessageRole.AGENT
+            thread_id=thread_id, role=MessageRole.AGENT
+        )
+    if final_message:
+        # Joining a comprehensive report is CPU-bound, keep it off the event loop so other
+        # tool calls stay responsive.
+        report_content = await asyncio.get_running_loop().run_in_executor(
+            None, create_research_summary, final_message
         )
-        if final_message:
-            report_content = create_research_summary(final_message)
+    if run.status == "completed" and report_content:
+        report_cache.set(key, report_content)
+    # The record is finished before the agent and thread are deleted, so it never points
+    # at a run that no longer exists.
+    try:
+        await run_registry.finish(key, _status_value(run.status), report_content)
+    except Exception as e:
+        logger.warning("Failed to record the result of run %s: %r", run.id, e)
+    return report_content or "No report content generated."
+
+
+async def _safe_delete(agents_client: AgentsClient, agent_id: str, thread_id: Optional[str] = None) -> None:
+    """Delete a run's agent and thread, logging failures instead of raising them."""
+    # NOTE: Skip this if you plan to reuse the agent later.
+    try:
+        await agents_client.delete_agent(agent_id)
+        logger.info("Deleted agent, ID: %s", agent_id)
+    except Exception as e:
+        logger.warning("Failed to delete agent %s: %r", agent_id, e)
+    if thread_id:
+        try:
+            await agents_client.threads.delete(thread_id)
+            logger.info("Deleted thread, ID: %s", thread_id)
+        except Exception as e:
+            logger.warning("Failed to delete thread %s: %r", thread_id, e)
+
+
+async def resume_active_runs() -> None:
+    """Resume runs that were still in progress when the worker last stopped."""
+    for record in await run_registry.active():
+        key = record["key"]
+        if key in _inflight:
+            continue
+        request = orjson.loads(record["request"]) if record["request"] else {}
+        logger.info("Resuming run %s for request %s (%s)", record["run_id"], key, request.get("research_topic", "unknown topic"))
+        _start_once(key, lambda record=record: _resume_run(record))
+
+def _validate_env() -> None:
+    """Exit with a clear error if any required environment variable is missing."""
+    required = {
+        "PROJECT_ENDPOINT": PROJECT_ENDPOINT,
+        "BING_RESOURCE_NAME": BING_RESOURCE_NAME,
+        "MODEL_DEPLOYMENT_NAME": MODEL_DEPLOYMENT_NAME,
+        "DEEP_RESEARCH_MODEL_DEPLOYMENT_NAME": DEEP_RESEARCH_MODEL_DEPLOYMENT_NAME,
+    }
+    missing = [name for name, value in required.items() if not value]
+    if missing:
+        logger.error("Missing required environment variables: %s", ", ".join(missing))
+        raise SystemExit(1)
 
-        # Clean-up and delete the agent once the run is finished.
-        # NOTE: Comment out this line if you plan to reuse the agent later.
-        await agents_client.delete_agent(agent.id)
-        logger.info("Deleted agent")
-        return report_content or "No report content generated."
 
 async def main():
+    _validate_env()
+
+    try:
+        await resume_active_runs()
+    except Exception as e:
+        logger.error("Failed to resume active runs: %r", e)
+
     # Run the MCP server
-    await mcp.run_async(transport="http", host="0.0.0.0", port=8001)
+    try:
+        await mcp.run_async(transport="http", host="0.0.0.0", port=8001)
+    finally:
+        # Stop following in-flight runs first; their records stay active so they are
+        # resumed on the next start. They schedule their clean-ups while unwinding, so
+        # wait for them before giving pending clean-ups a moment to finish and closing
+        # the client.
+        inflight = list(_inflight.values())
+        for task in inflight:
+            task.cancel()
+        if inflight:
+            await asyncio.wait(inflight, timeout=5)
+        if _background_tasks:
+            await asyncio.wait(_background_tasks, timeout=5)
+        await run_registry.close()
+        await close_project_client()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
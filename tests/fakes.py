@@ -0,0 +1,215 @@
+"""Fake Azure AI Agents client and a test case that points the server at it."""
+
+import asyncio
+import logging
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from azure.ai.agents.models import AgentStreamEvent, MessageDeltaChunk, ThreadMessage, ThreadRun
+
+import deep_research_mcp as server
+
+logging.disable(logging.CRITICAL)
+
+# FastMCP wraps the tool function, the tests call the function itself.
+retrieve_deep_research_report = getattr(server.retrieve_deep_research_report, "fn", server.retrieve_deep_research_report)
+
+
+def make_run(status: str, run_id: str = "run-1") -> ThreadRun:
+    return ThreadRun({"id": run_id, "status": status, "thread_id": "thread-1", "agent_id": "agent-1"})
+
+
+def make_message(text: str, citations: tuple[tuple[str, str], ...] = ()) -> ThreadMessage:
+    annotations = [
+        {"type": "url_citation", "text": f"[{i}]", "url_citation": {"url": url, "title": title}}
+        for i, (url, title) in enumerate(citations)
+    ]
+    return ThreadMessage({
+        "id": "message-1",
+        "role": "assistant",
+        "status": "completed",
+        "thread_id": "thread-1",
+        "content": [{"type": "text", "text": {"value": text, "annotations": annotations}}],
+    })
+
+
+def make_delta(text: str) -> MessageDeltaChunk:
+    return MessageDeltaChunk({
+        "id": "message-1",
+        "object": "thread.message.delta",
+        "delta": {"content": [{"index": 0, "type": "text", "text": {"value": text}}]},
+    })
+
+
+def stream_events(*deltas: str, message: ThreadMessage = None, final_status: str = "completed") -> list:
+    """Events of a run that streams `deltas` and then finishes with `final_status`."""
+    events = [(AgentStreamEvent.THREAD_RUN_CREATED, make_run("in_progress"), None)]
+    events += [(AgentStreamEvent.THREAD_MESSAGE_DELTA, make_delta(d), None) for d in deltas]
+    if message is not None:
+        events.append((AgentStreamEvent.THREAD_MESSAGE_COMPLETED, message, None))
+    events.append((AgentStreamEvent.THREAD_RUN_COMPLETED, make_run(final_status), None))
+    return events
+
+
+class FakeContext:
+    """Records the messages a tool call sends to its MCP client."""
+
+    def __init__(self):
+        self.messages: list[str] = []
+
+    async def info(self, message: str) -> None:
+        self.messages.append(message)
+
+    async def error(self, message: str) -> None:
+        self.messages.append(message)
+
+
+class FakeStream:
+    def __init__(self, events: list, error: Exception = None):
+        self._events = events
+        self._error = error
+
+    async def __aenter__(self) -> "FakeStream":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def __aiter__(self):
+        for event in self._events:
+            await asyncio.sleep(0)
+            yield event
+        if self._error is not None:
+            raise self._error
+
+
+class FakeRuns:
+    def __init__(self, client: "FakeAgentsClient"):
+        self._client = client
+
+    async def create(self, thread_id: str, agent_id: str) -> ThreadRun:
+        self._client.calls.append("runs.create")
+        return make_run("queued")
+
+    async def get(self, thread_id: str, run_id: str) -> ThreadRun:
+        self._client.calls.append("runs.get")
+        self._client.polls += 1
+        if self._client.finished.is_set() or (self._client.steps is not None and self._client.polls >= self._client.steps):
+            return make_run(self._client.final_status, run_id)
+        return make_run("in_progress", run_id)
+
+    async def cancel(self, thread_id: str, run_id: str) -> ThreadRun:
+        self._client.calls.append("runs.cancel")
+        return make_run("cancelling", run_id)
+
+
+class FakeStreamingRuns(FakeRuns):
+    async def stream(self, thread_id: str, agent_id: str) -> FakeStream:
+        self._client.calls.append("runs.stream")
+        return FakeStream(self._client.events, self._client.stream_error)
+
+
+class FakeThreads:
+    def __init__(self, client: "FakeAgentsClient"):
+        self._client = client
+
+    async def create(self) -> SimpleNamespace:
+        self._client.calls.append("threads.create")
+        return SimpleNamespace(id="thread-1")
+
+    async def delete(self, thread_id: str) -> None:
+        self._client.calls.append("threads.delete")
+
+
+class FakeMessages:
+    def __init__(self, client: "FakeAgentsClient"):
+        self._client = client
+
+    async def create(self, **kwargs) -> SimpleNamespace:
+        self._client.calls.append("messages.create")
+        return SimpleNamespace(id="message-0")
+
+    async def get_last_message_by_role(self, thread_id: str, role) -> ThreadMessage:
+        self._client.calls.append("messages.get_last_message_by_role")
+        return make_message(self._client.report)
+
+
+class FakeAgentsClient:
+    """Agents client whose runs finish after `steps` polls, or once `finished` is set.
+
+    With `events` the client also supports `runs.stream`, replaying them and then raising
+    `stream_error` if given. Every call is recorded in `calls`.
+    """
+
+    def __init__(self, steps=2, final_status="completed", report="report", events=None, stream_error=None):
+        self.steps = steps
+        self.final_status = final_status
+        self.report = report
+        self.events = events
+        self.stream_error = stream_error
+        self.finished = asyncio.Event()
+        self.polls = 0
+        self.calls: list[str] = []
+        self.runs = FakeStreamingRuns(self) if events is not None else FakeRuns(self)
+        self.threads = FakeThreads(self)
+        self.messages = FakeMessages(self)
+
+    async def create_agent(self, **kwargs) -> SimpleNamespace:
+        self.calls.append("create_agent")
+        return SimpleNamespace(id="agent-1")
+
+    async def delete_agent(self, agent_id: str) -> None:
+        self.calls.append("delete_agent")
+
+
+class ServerTestCase(unittest.IsolatedAsyncioTestCase):
+    """Run the server against a fake agents client and a temporary run registry."""
+
+    poll_strategy = "adaptive"
+
+    async def asyncSetUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "runs.db")
+        self.registry = server.RunRegistry(self.db_path)
+        self.client = FakeAgentsClient()
+
+        async def get_project_client():
+            return SimpleNamespace(agents=self.client)
+
+        async def get_deep_research_tool(project_client):
+            return SimpleNamespace(definitions=[])
+
+        for name, value in {
+            "get_project_client": get_project_client,
+            "get_deep_research_tool": get_deep_research_tool,
+            "run_registry": self.registry,
+            "report_cache": server.ReportCache(max_entries=16, ttl_s=60),
+            "_inflight": {},
+            "_run_slots": asyncio.Semaphore(server.MAX_CONCURRENT_RUNS),
+            "POLL_STRATEGY": self.poll_strategy,
+            "ADAPTIVE_POLL_INITIAL_S": 0.001,
+            "ADAPTIVE_POLL_MAX_S": 0.002,
+            "ADAPTIVE_POLL_JITTER_S": 0,
+        }.items():
+            patcher = mock.patch.object(server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        for task in list(server._inflight.values()):
+            task.cancel()
+        await self.settle()
+        await self.registry.close()
+
+    async def settle(self) -> None:
+        """Wait for background clean-ups and registry writes to finish."""
+        while server._background_tasks:
+            await asyncio.wait(list(server._background_tasks))
+
+    def request(self, research_topic: str = "topic") -> tuple[server.ResearchRequest, str]:
+        req = server.ResearchRequest(research_topic, "comprehensive", "en", None)
+        return req, server.request_key(req)
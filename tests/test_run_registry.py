@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import orjson
+
+from tests.fakes import server
+
+
+class RunRegistryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "runs.db")
+        self.registry = server.RunRegistry(self.db_path, ttl_s=60)
+
+    async def asyncTearDown(self):
+        await self.registry.close()
+
+    async def test_records_and_finishes_a_run(self):
+        await self.registry.add("key", "thread-1", "run-1", "agent-1", "queued", request={"research_topic": "topic"})
+        record = await self.registry.get("key")
+        self.assertEqual((record["thread_id"], record["run_id"], record["agent_id"]), ("thread-1", "run-1", "agent-1"))
+        self.assertEqual(record["status"], "queued")
+        self.assertEqual(orjson.loads(record["request"]), {"research_topic": "topic"})
+
+        await self.registry.finish("key", "completed", "report")
+        record = await self.registry.get("key")
+        self.assertEqual((record["status"], record["report"]), ("completed", "report"))
+        self.assertIsNone(await self.registry.get("other"))
+
+    async def test_active_returns_queued_and_in_progress_runs(self):
+        await self.registry.add("queued", "thread-1", "run-1", "agent-1", "queued")
+        await self.registry.add("in_progress", "thread-2", "run-2", "agent-2", "in_progress")
+        await self.registry.add("failed", "thread-3", "run-3", "agent-3", "in_progress")
+        await self.registry.finish("failed", "failed")
+        self.assertEqual(sorted(record["key"] for record in await self.registry.active()), ["in_progress", "queued"])
+
+    async def test_adds_request_column_to_older_databases(self):
+        with sqlite3.connect(self.db_path) as db:
+            db.execute(
+                "CREATE TABLE runs (key TEXT PRIMARY KEY, thread_id TEXT, run_id TEXT, agent_id TEXT, "
+                "created_at REAL, status TEXT, report TEXT)"
+            )
+        await self.registry.add("key", "thread-1", "run-1", "agent-1", "queued", request={"language": "en"})
+        self.assertEqual(orjson.loads((await self.registry.get("key"))["request"]), {"language": "en"})
+
+    async def test_prunes_finished_runs_past_the_ttl(self):
+        for key in ("old", "old_active", "new"):
+            await self.registry.add(key, "thread-1", "run-1", "agent-1", "in_progress")
+        await self.registry.finish("old", "completed", "report")
+        db = await self.registry._connect()
+        await db.execute("UPDATE runs SET created_at = 0 WHERE key != 'new'")
+        await db.commit()
+
+        await self.registry.finish("new", "completed", "report")
+        self.assertIsNone(await self.registry.get("old"))
+        self.assertIsNotNone(await self.registry.get("old_active"))
+        self.assertIsNotNone(await self.registry.get("new"))
+
+
+if __name__ == "__main__":
+    unittest.main()
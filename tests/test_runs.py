@@ -0,0 +1,146 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+from tests.fakes import FakeContext, ServerTestCase, retrieve_deep_research_report, server
+
+
+class RunTest(ServerTestCase):
+    async def test_runs_the_request_and_cleans_up(self):
+        report = await retrieve_deep_research_report("topic", FakeContext())
+        await self.settle()
+        self.assertEqual(report, "report")
+        self.assertEqual(self.client.calls.count("runs.create"), 1)
+        self.assertIn("delete_agent", self.client.calls)
+        self.assertIn("threads.delete", self.client.calls)
+        _, key = self.request()
+        record = await self.registry.get(key)
+        self.assertEqual((record["status"], record["report"]), ("completed", "report"))
+
+    async def test_serves_repeated_requests_from_the_cache(self):
+        await retrieve_deep_research_report("topic", FakeContext())
+        ctx = FakeContext()
+        self.assertEqual(await retrieve_deep_research_report("  Topic ", ctx), "report")
+        self.assertEqual(self.client.calls.count("runs.create"), 1)
+        self.assertIn("Returning cached report.", ctx.messages)
+
+    async def test_identical_requests_share_one_run(self):
+        self.client.steps = None
+        first = asyncio.create_task(retrieve_deep_research_report("topic", FakeContext()))
+        second = asyncio.create_task(retrieve_deep_research_report("topic", FakeContext()))
+        await asyncio.sleep(0.05)
+        self.client.finished.set()
+        self.assertEqual(await asyncio.gather(first, second), ["report", "report"])
+        self.assertEqual(self.client.calls.count("runs.create"), 1)
+
+    async def test_cancelling_the_first_caller_keeps_the_shared_run(self):
+        self.client.steps = None
+        first = asyncio.create_task(retrieve_deep_research_report("topic", FakeContext()))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(retrieve_deep_research_report("topic", FakeContext()))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        self.client.finished.set()
+        self.assertEqual(await second, "report")
+        self.assertTrue(first.cancelled())
+        self.assertNotIn("runs.cancel", self.client.calls)
+
+    async def test_serves_requests_when_the_registry_is_unavailable(self):
+        broken = server.RunRegistry(os.path.join(self.db_path, "missing", "runs.db"))
+        with mock.patch.object(server, "run_registry", broken):
+            self.assertEqual(await retrieve_deep_research_report("topic", FakeContext()), "report")
+        await self.settle()
+        self.assertIn("delete_agent", self.client.calls)
+
+    async def test_redelivers_a_recorded_report(self):
+        _, key = self.request()
+        await self.registry.add(key, "thread-1", "run-1", "agent-1", "in_progress")
+        await self.registry.finish(key, "completed", "recorded report")
+        self.assertEqual(await retrieve_deep_research_report("topic", FakeContext()), "recorded report")
+        self.assertEqual(self.client.calls, [])
+
+    async def test_attaches_to_a_recorded_run(self):
+        _, key = self.request()
+        await self.registry.add(key, "thread-1", "run-1", "agent-1", "in_progress")
+        self.assertEqual(await retrieve_deep_research_report("topic", FakeContext()), "report")
+        await self.settle()
+        self.assertNotIn("runs.create", self.client.calls)
+        self.assertEqual((await self.registry.get(key))["status"], "completed")
+
+    async def test_starts_a_new_run_when_the_recorded_run_cannot_be_resumed(self):
+        _, key = self.request()
+        await self.registry.add(key, "gone-thread", "gone-run", "gone-agent", "in_progress")
+        get = self.client.runs.get
+
+        async def get_or_fail(thread_id, run_id):
+            if run_id == "gone-run":
+                raise RuntimeError("run not found")
+            return await get(thread_id, run_id)
+
+        self.client.runs.get = get_or_fail
+        self.assertEqual(await retrieve_deep_research_report("topic", FakeContext()), "report")
+        await self.settle()
+        self.assertEqual(self.client.calls.count("runs.create"), 1)
+        self.assertEqual(self.client.calls.count("delete_agent"), 2)
+        record = await self.registry.get(key)
+        self.assertEqual((record["run_id"], record["status"]), ("run-1", "completed"))
+
+    async def test_resume_does_not_cancel_a_run_that_already_finished(self):
+        # The run finished while the server was down and its timeout has since passed.
+        self.client.steps = 1
+        _, key = self.request()
+        await self.registry.add(key, "thread-1", "run-1", "agent-1", "in_progress")
+        record = dict(await self.registry.get(key), created_at=0)
+        self.assertEqual(await server._resume_run(record, FakeContext()), "report")
+        await self.settle()
+        self.assertNotIn("runs.cancel", self.client.calls)
+        self.assertEqual((await self.registry.get(key))["status"], "completed")
+
+    async def test_cancel_run_returns_a_run_that_already_finished(self):
+        async def cancel(thread_id, run_id):
+            raise RuntimeError("run is already completed")
+
+        self.client.steps = 1
+        self.client.runs.cancel = cancel
+        run = await server._cancel_run(self.client, "thread-1", "run-1")
+        self.assertEqual(server._status_value(run.status), "completed")
+
+    async def test_resumes_active_runs_on_startup(self):
+        await self.registry.add("key", "thread-1", "run-1", "agent-1", "in_progress", request={"research_topic": "topic"})
+        await server.resume_active_runs()
+        self.assertIn("key", server._inflight)
+        self.assertEqual(await server._inflight["key"], "report")
+        await self.settle()
+        self.assertEqual((await self.registry.get("key"))["status"], "completed")
+
+    async def test_failure_after_the_run_is_recorded_cancels_it_and_marks_it_failed(self):
+        async def get(thread_id, run_id):
+            raise RuntimeError("connection reset")
+
+        self.client.runs.get = get
+        req, key = self.request()
+        with self.assertRaises(RuntimeError):
+            await server._start_run(key, req, FakeContext())
+        await self.settle()
+        self.assertIn("runs.cancel", self.client.calls)
+        self.assertIn("delete_agent", self.client.calls)
+        self.assertEqual((await self.registry.get(key))["status"], "failed")
+
+    async def test_cancellation_keeps_a_recorded_run_for_resuming(self):
+        self.client.steps = None
+        req, key = self.request()
+        task = asyncio.create_task(server._start_run(key, req, FakeContext()))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await self.settle()
+        self.assertNotIn("runs.cancel", self.client.calls)
+        self.assertNotIn("delete_agent", self.client.calls)
+        self.assertIn((await self.registry.get(key))["status"], server.ACTIVE_RUN_STATUSES)
+
+
+if __name__ == "__main__":
+    unittest.main()
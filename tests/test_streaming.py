@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+
+from azure.core.exceptions import ServiceResponseError
+
+from tests.fakes import (
+    FakeAgentsClient,
+    FakeContext,
+    ServerTestCase,
+    make_message,
+    retrieve_deep_research_report,
+    server,
+    stream_events,
+)
+
+
+class DeltaForwarderTest(unittest.IsolatedAsyncioTestCase):
+    async def test_batches_deltas_without_losing_text(self):
+        ctx = FakeContext()
+        async with server._DeltaForwarder(ctx, flush_interval_s=0.05) as forwarder:
+            for i in range(200):
+                forwarder.push(f"w{i} ")
+                if i % 50 == 0:
+                    await asyncio.sleep(0.06)
+        self.assertEqual("".join(ctx.messages), "".join(f"w{i} " for i in range(200)))
+        self.assertLess(len(ctx.messages), 20)
+
+    async def test_flushes_once_enough_text_is_pending(self):
+        ctx = FakeContext()
+        async with server._DeltaForwarder(ctx, flush_interval_s=60, flush_chars=10) as forwarder:
+            forwarder.push("0123456789")
+            await asyncio.sleep(0.01)
+            self.assertEqual(ctx.messages, ["0123456789"])
+
+    async def test_does_nothing_without_a_context(self):
+        async with server._DeltaForwarder() as forwarder:
+            forwarder.push("text")
+
+
+class StreamRunTest(ServerTestCase):
+    poll_strategy = "stream"
+
+    async def test_forwards_status_text_and_citations_in_order(self):
+        message = make_message("Hello world", citations=(("https://example.com", "Example"),))
+        self.client = FakeAgentsClient(events=stream_events("Hello ", "world", message=message))
+        ctx = FakeContext()
+        run, last_message = await server._stream_run(self.client, "thread-1", "agent-1", ctx)
+        self.assertEqual(server._status_value(run.status), "completed")
+        self.assertIs(last_message, message)
+        self.assertEqual(
+            "".join(ctx.messages),
+            "\nRun status: RunStatus.IN_PROGRESS\nHello world\nURL Citation: [Example](https://example.com)\n"
+            "\nRun status: RunStatus.COMPLETED\n",
+        )
+
+    async def test_records_the_run_once_it_is_created(self):
+        self.client = FakeAgentsClient(events=stream_events("text"))
+        created = []
+
+        async def on_run_created(run):
+            created.append(run.id)
+
+        await server._stream_run(self.client, "thread-1", "agent-1", on_run_created=on_run_created)
+        self.assertEqual(created, ["run-1"])
+
+    async def test_falls_back_to_polling_when_the_connection_drops(self):
+        events = stream_events("partial")[:-1]
+        self.client = FakeAgentsClient(events=events, stream_error=ServiceResponseError("connection reset"))
+        run, last_message = await server._stream_run(self.client, "thread-1", "agent-1", FakeContext())
+        self.assertEqual(server._status_value(run.status), "completed")
+        self.assertIn("runs.get", self.client.calls)
+        self.assertEqual(last_message.text_messages[0].text.value, "report")
+
+    async def test_raises_when_the_connection_drops_before_the_run_exists(self):
+        self.client = FakeAgentsClient(events=[], stream_error=ServiceResponseError("connection reset"))
+        with self.assertRaises(ServiceResponseError):
+            await server._stream_run(self.client, "thread-1", "agent-1", FakeContext())
+
+    async def test_tool_returns_the_streamed_report(self):
+        self.client = FakeAgentsClient(events=stream_events("Hello", message=make_message("Hello")))
+        ctx = FakeContext()
+        self.assertEqual(await retrieve_deep_research_report("topic", ctx), "Hello")
+        self.assertNotIn("runs.get", self.client.calls)
+        self.assertIn("Run status: RunStatus.COMPLETED", "".join(ctx.messages))
+
+
+if __name__ == "__main__":
+    unittest.main()